@@ -7,8 +7,7 @@ from agent.Crazyflie import Crazyflie
 
 
 def up_and_down(cf):
-    rospy.init_node("integration_test")
-    cf.goto(0, 0, 1.5)
+    cf.goto_xyz(0, 0, 1.5)
     cf.sleep_until_inactive()
     cf.land()
     cf.sleep_until_inactive()
@@ -21,19 +20,19 @@ def circle_trajectory(n_pts, r):
         x.append(r * math.cos(2 * math.pi * i / n_pts))
         y.append(r * math.sin(2 * math.pi * i / n_pts))
 
-    rospy.init_node("integration_test")
-    cf.goto(r, 0, 1.5)
+    cf.goto_xyz(r, 0, 1.5)
     cf.sleep_until_inactive()
     for i in range(len(x)):
-        cf.goto(x[i], y[i], 1.5)
+        cf.goto_xyz(x[i], y[i], 1.5)
         cf.sleep_until_inactive()
-    cf.goto(0, 0, 1.5)
+    cf.goto_xyz(0, 0, 1.5)
     cf.sleep_until_inactive()
     cf.land()
     cf.sleep_until_inactive()
 
 
 if __name__ == '__main__':
+    rospy.init_node("integration_test")
     cf = Crazyflie(1)
     up_and_down(cf)
     # circle_trajectory(50, 0.8)
\ No newline at end of file
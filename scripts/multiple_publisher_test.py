@@ -12,22 +12,20 @@ from tools.visualization.VisualizationPublisher import VisualizationPublisher
 # Testing the class VisualizationPublisher.py
 
 def up_and_down(drones):
-    rospy.init_node("multiple_publisher_test")
     r = rospy.Rate(RATE)
     publisher = VisualizationPublisher(drones)
     for i in range(4):
-        drones[i].goto(0, 0, 1.5)
+        drones[i].goto_xyz(0, 0, 1.5)
     while not (drones[0].is_inactive() and drones[1].is_inactive() and drones[2].is_inactive() and drones[3].is_inactive()):
-        publisher.visualize()
         r.sleep()
     for i in range(4):
         drones[i].land()
     while not (drones[0].is_inactive() and drones[1].is_inactive() and drones[2].is_inactive() and drones[3].is_inactive()):
-        publisher.visualize()
         r.sleep()
 
 
 if __name__ == '__main__':
+    rospy.init_node("multiple_publisher_test")
     cf1 = Crazyflie(1)
     cf2 = Crazyflie(2)
     cf3 = Crazyflie(3)
@@ -4,16 +4,17 @@ import math
 import rospy
 import time
 from crazyflie_driver.msg import GenericLogData
-from geometry_msgs.msg import Pose, Point
-from tf.transformations import quaternion_from_euler
+from geometry_msgs.msg import Pose
 
 from agent.CrazyflieStateMachine import CrazyflieStateMachine
-from decision_making.MeshNode import MeshNode
 from decision_making.trajectory.Trajectory import Trajectory
 from representations.StablePose import StablePose
-from representations.Constants import MAX_VEL, MAX_VEL, MAX_VEL, MAX_VEL_YAW
+from representations.Constants import MAX_VEL, MAX_VEL_YAW
 from CrazyflieServices import CrazyflieServices
 
+# Converts degrees to half of the angle in radians, used for quaternions
+HALF_DEG_TO_RAD = math.pi / 360.0
+
 
 class Crazyflie:
     """
@@ -31,14 +32,23 @@ class Crazyflie:
         self.__state_machine = CrazyflieStateMachine()
         self.__services = CrazyflieServices(drone_id, high_level)
         self.__pose = Pose()
+        self.__pose_seq = 0  # Incremented at every pose update
+        self.__stable_pose = None  # Cache of the pose as a StablePose
+        self.__stable_pose_seq = -1  # Value of __pose_seq when __stable_pose was computed
         self.__mesh_node = None
         self.__path = None
 
         prefix = "/cf" + str(drone_id)
         self.__prefix = prefix
+        # Only the latest pose matters: drop stale messages and don't let Nagle's algorithm
+        # delay the small pose packets. rospy has no callback queue, __pose_callback runs directly
+        # on the connection's receive thread, so it must stay short and free of blocking calls.
         self.__position_subs = rospy.Subscriber(prefix + '/local_position',
                                                 GenericLogData,
-                                                self.__pose_callback)
+                                                self.__pose_callback,
+                                                queue_size=1,
+                                                buff_size=2 ** 16,
+                                                tcp_nodelay=True)
 
     @property
     def id(self):
@@ -59,10 +69,17 @@ class Crazyflie:
     @property
     def stable_pose(self):
         """
-        Current pose: position, yaw.
+        Current pose: position, yaw. It is only converted again when the pose changes, so every
+        caller gets the same StablePose object until then, which must not be modified.
         :return: StablePose object
         """
-        return StablePose.from_ros(self.__pose)
+        # The sequence is read before converting, so a pose updated during the conversion is
+        # converted again on the next call
+        seq = self.__pose_seq
+        if self.__stable_pose_seq != seq:
+            self.__stable_pose = StablePose.from_ros(self.__pose)
+            self.__stable_pose_seq = seq
+        return self.__stable_pose
 
     @property
     def path(self):
@@ -120,23 +137,25 @@ class Crazyflie:
     def dist(self, arg):
         """
         Returns the distance to a certain object.
-        :param arg: Object to calculate distance. Can be Point, Pose, MeshNode or Crazyflie.
+        :param arg: Object to calculate distance. Can be Point, Pose, StablePose, MeshNode or
+        Crazyflie.
         :return: float, distance to the object.
         """
-        p = self.pose.position
-        if isinstance(arg, Point):
-            return math.hypot(math.hypot(p.x - arg.x, p.y - arg.y), p.z - arg.z)
-        elif isinstance(arg, MeshNode):
-            return math.hypot(math.hypot(p.x - arg.x, p.y - arg.y), p.z - arg.z)
-        elif isinstance(arg, Pose):
-            return self.dist(arg.position)
-        elif isinstance(arg, StablePose):
-            return self.dist(arg.position())
-        elif isinstance(arg, Crazyflie):
-            return self.dist(arg.pose)
-        else:
+        if isinstance(arg, Crazyflie):
+            arg = arg.pose
+        if isinstance(arg, Pose):
+            arg = arg.position
+
+        # Point, MeshNode and StablePose all have x, y and z
+        p = self.__pose.position
+        try:
+            dx = p.x - arg.x
+            dy = p.y - arg.y
+            dz = p.z - arg.z
+        except AttributeError:
             raise ValueError("Crazyflie can't calculate distances to object of type " +
                              type(arg).__name__)
+        return math.sqrt(dx * dx + dy * dy + dz * dz)
 
     def goto(self, *args, **kwargs):
         """
@@ -163,26 +182,25 @@ class Crazyflie:
             >> cf.goto(StablePose(0, 0, 1), relative=False, duration=4.0)
         """
         if len(args) == 1:
-            goal_stable_pose = args[0]
+            self.__goto(args[0], kwargs.get('relative', False), kwargs.get('duration', -1),
+                        kwargs.get('group_mask', 0))
         else:
-            yaw = 0
-            if len(args) == 4:
-                yaw = args[3]
-            goal_stable_pose = StablePose(args[0], args[1], args[2], yaw)
-
-        relative = False
-        if 'relative' in kwargs:
-            relative = kwargs['relative']
-
-        duration = -1
-        if 'duration' in kwargs:
-            duration = kwargs['duration']
-
-        group_mask = 0
-        if 'group_mask' in kwargs:
-            group_mask = kwargs['group_mask']
+            self.goto_xyz(*args, **kwargs)
 
-        self.__goto(goal_stable_pose, relative, duration, group_mask)
+    def goto_xyz(self, x, y, z, yaw=0, relative=False, duration=-1, group_mask=0):
+        """
+        Moves the Crazyflie in a straight line to another pose. Same as goto, but without
+        parsing the arguments.
+        :param x: x for the desired StablePose.
+        :param y: y for the desired StablePose.
+        :param z: z for the desired StablePose.
+        :param yaw: yaw for the desired StablePose.
+        :param relative: Bool if the given pose is global or relative to the drone.
+        :param duration: How much time the robot should take to do the task. If -1 will be
+              calculated using maximum velocity.
+        :param group_mask: TODO: what is this?
+        """
+        self.__goto(StablePose(x, y, z, yaw), relative, duration, group_mask)
 
     def land(self, target_height=0.0, duration=-1, group_mask=0):
         """
@@ -214,10 +232,14 @@ class Crazyflie:
               calculated using maximum velocity.
         :param group_mask: TODO: what is this?
         """
-        delta = goal_stable_pose - self.stable_pose
         if duration == -1:
-            duration = max(abs(delta.x) / MAX_VEL, abs(delta.y) / MAX_VEL,
-                           abs(delta.z) / MAX_VEL, abs(delta.yaw) / MAX_VEL_YAW)
+            current = self.stable_pose
+            # Yaw difference normalized to [-pi, pi]
+            d_yaw = (goal_stable_pose.yaw - current.yaw + math.pi) % (2 * math.pi) - math.pi
+            duration = max(abs(goal_stable_pose.x - current.x) / MAX_VEL,
+                           abs(goal_stable_pose.y - current.y) / MAX_VEL,
+                           abs(goal_stable_pose.z - current.z) / MAX_VEL,
+                           abs(d_yaw) / MAX_VEL_YAW)
 
         if self.__state_machine.is_stopped():
             self.__takeoff(1)  # Tested a bit and 1m seems to work. I tried putting a really small
@@ -245,10 +267,17 @@ class Crazyflie:
         self.__pose.position.x = data.values[0]
         self.__pose.position.y = data.values[1]
         self.__pose.position.z = data.values[2]
-        quaternion = quaternion_from_euler(math.radians(data.values[3]),
-                                           math.radians(data.values[4]),
-                                           math.radians(data.values[5]))
-        self.__pose.orientation.x = quaternion[0]
-        self.__pose.orientation.y = quaternion[1]
-        self.__pose.orientation.z = quaternion[2]
-        self.__pose.orientation.w = quaternion[3]
+        # Same as tf's quaternion_from_euler(roll, pitch, yaw), written inline because this
+        # callback runs at the telemetry rate
+        hr = data.values[3] * HALF_DEG_TO_RAD
+        hp = data.values[4] * HALF_DEG_TO_RAD
+        hy = data.values[5] * HALF_DEG_TO_RAD
+        cr, sr = math.cos(hr), math.sin(hr)
+        cp, sp = math.cos(hp), math.sin(hp)
+        cy, sy = math.cos(hy), math.sin(hy)
+        orientation = self.__pose.orientation
+        orientation.x = sr * cp * cy - cr * sp * sy
+        orientation.y = cr * sp * cy + sr * cp * sy
+        orientation.z = cr * cp * sy - sr * sp * cy
+        orientation.w = cr * cp * cy + sr * sp * sy
+        self.__pose_seq += 1
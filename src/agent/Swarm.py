@@ -31,6 +31,7 @@ class Swarm:
         self.__drones = {}
         for i in drone_ids:
             self.__drones[i] = Crazyflie(i)
+        self.__drones_snapshot = tuple(self.__drones.values())  # Rebuilt when drones change
         self.__goal_poses = None
         self.__obstacle_collection = ObstacleCollection()
         self.__decision_making = DecisionMaking(self.__drones)
@@ -95,8 +96,7 @@ class Swarm:
         """
         with self.__lock:
             if drone_id == 0:
-                for key in self.__drones.keys():
-                    self.__decision_making.stop_drone(key)
+                self.__decision_making.stop_all()
             else:
                 self.__decision_making.stop_drone(drone_id)
 
@@ -114,9 +114,12 @@ class Swarm:
         Adds a drone to the dict of used drones.
         :param drone_id: Id of the new drone.
         """
+        # Connecting to the drone's services can take a while, so it is done outside the lock
+        drone = Crazyflie(drone_id)
         with self.__lock:
-            self.__drones[drone_id] = Crazyflie(drone_id)
-            self.__visualization_publisher.add_drone(self.__drones[drone_id])
+            self.__drones[drone_id] = drone
+            self.__drones_snapshot = tuple(self.__drones.values())
+            self.__visualization_publisher.add_drone(drone)
 
     def remove_drone(self, drone_id=0):
         """
@@ -128,18 +131,21 @@ class Swarm:
                 self.__drones.clear()
             else:
                 del self.__drones[drone_id]
+            self.__drones_snapshot = tuple(self.__drones.values())
             self.__visualization_publisher.remove_drone(drone_id)
 
     def __get_drone_poses(self):
         """
-        Creates a dict of drone poses from self.__drones. Use this to safely access these poses
-        from thread issues.
+        Creates a dict of drone poses from a snapshot of self.__drones. Use this to safely access
+        these poses from thread issues. The lock is only held to read the snapshot.
         :return: Dict of Pose objects for each drone_id.
         """
-        drone_poses = {}
         with self.__lock:
-            for drone_id in self.__drones:
-                drone_poses[drone_id] = self.__drones[drone_id].pose
+            drones = self.__drones_snapshot
+
+        drone_poses = {}
+        for drone in drones:
+            drone_poses[drone.id] = drone.pose
 
         return drone_poses
 
@@ -9,9 +9,8 @@ from sensor_msgs.msg import Image
 from decision_making.Delta import Delta
 from decision_making.trajectory.Path import Path
 from representations.Constants import EPS
+from representations.Constants import EPS_SQUARED
 from representations.Constants import MAX_VEL
-from representations.Point import Point
-from representations.Segment import Segment
 
 
 class Coordinator:
@@ -20,6 +19,21 @@ class Coordinator:
         self.__i_to_drone_id = {}
         self.__delta = None
         self.__paths = {}
+        self.__img_publisher = None  # Created on the first plot, then reused
+
+        # Intersections flattened into arrays, one entry per intersection between drones i < j
+        self.__ori = None
+        self.__i1_lo = None
+        self.__i1_hi = None
+        self.__i2_lo = None
+        self.__i2_hi = None
+        self.__idx_i = None
+        self.__idx_j = None
+        # Edge of each intersection which blocks one of the drones, see __event_dt
+        self.__wall = None
+        self.__span = None
+        self.__idx_p = None
+        self.__idx_q = None
 
     def coordinate(self, paths, visualize=False):
         """
@@ -42,35 +56,55 @@ class Coordinator:
 
         # Computes intersections
         self.__delta = Delta(paths)
-
-        # Initializing vectors x and t, and x_goal
-        x0 = np.zeros(self.__n_drones, dtype=float)
-        x = [x0]  # List of np arrays, size n_events x n_drones
-        t = [0.0]  # List size n_events
-        x_goal = []
-        for drone_id in paths:
-            x_goal.append(paths[drone_id].length)
-        x_goal = np.array(x_goal)
-
-        # Running loop: going through each event, calculating velocities and setting new poses at
-        # each step
-        while np.any(np.abs(x[-1] - x_goal) > EPS):
-            v = self.__maximal_velocity(x, x_goal)
-            dt = self.__event_dt(x, x_goal, v)
-            x.append(x[-1] + v * dt)
-            t.append(t[-1] + dt)
-
-        self.__paths = paths
-        if visualize:
-            self.plot(x)
-
-        return self.__to_paths(x, t, paths)
+        # The flattened intersections are only valid for this call, also when it raises
+        try:
+            self.__flatten_intersections()
+
+            # Initializing x_prev and x_goal, and the buffers holding x and t for each event. Each
+            # drone reaching its goal is an event, and each intersection makes at most two events:
+            # reaching its blocking edge and leaving it
+            max_events = 1 + self.__n_drones + 2 * len(self.__ori)
+            x_prev = np.zeros(self.__n_drones, dtype=float)
+            x = np.empty((max_events, self.__n_drones), dtype=float)  # Size n_events x n_drones
+            t = np.empty(max_events, dtype=float)  # Size n_events
+            x[0] = x_prev
+            t[0] = 0.0
+            n_events = 1
+            x_goal = []
+            for drone_id in paths:
+                x_goal.append(paths[drone_id].length)
+            x_goal = np.array(x_goal)
+
+            # Running loop: going through each event, calculating velocities and setting new poses at
+            # each step
+            while np.any(np.abs(x_prev - x_goal) > EPS):
+                v = self.__maximal_velocity(x_prev, x_goal)
+                dt = self.__event_dt(x_prev, x_goal, v)
+                x_prev = x_prev + v * dt
+
+                # Doubling the buffers if they are full anyway
+                if n_events == len(t):
+                    x = np.concatenate((x, np.empty_like(x)))
+                    t = np.concatenate((t, np.empty_like(t)))
+                x[n_events] = x_prev
+                t[n_events] = t[n_events - 1] + dt
+                n_events += 1
+            x = x[:n_events]
+            t = t[:n_events]
+
+            self.__paths = paths
+            if visualize:
+                self.plot(x)
+
+            return self.__to_paths(x, t, paths)
+        finally:
+            self.__clear_intersections()
 
     def plot(self, x):
         """
         Plots the delta space with matplotlib, for every pair of drones.
         TODO: put this outside coordinator.
-        :param x: List of np.array of size n_drones and dtype float. Contains, for each step,
+        :param x: np.array of size n_events x n_drones and dtype float. Contains, for each step,
         the position for each drone in the coordination space.
         """
         n_axis = int(len(self.__delta) / 2)
@@ -127,9 +161,11 @@ class Coordinator:
             data = list(np.fromstring(fig.canvas.tostring_rgb(), dtype=np.uint8, sep=''))
             h = fig.canvas.get_width_height()[1]
             w = fig.canvas.get_width_height()[0]
-            img_publisher = rospy.Publisher('delta_space', Image, queue_size=10, latch=True)
+            if self.__img_publisher is None:
+                self.__img_publisher = rospy.Publisher('delta_space', Image, queue_size=10,
+                                                       latch=True)
             img = Image(height=h, width=w, data=data, encoding="rgb8", step=3 * w)
-            img_publisher.publish(img)
+            self.__img_publisher.publish(img)
         except rospy.ROSException:
             plt.show()
 
@@ -142,41 +178,84 @@ class Coordinator:
         """
         return paths
 
-    def __maximal_velocity(self, x, x_goal):
+    def __flatten_intersections(self):
+        """
+        Flattens the intersections in self.__delta into arrays, so the intersections of all pairs
+        of drones can be checked at once at each event. Only pairs i < j are stored.
+        O(n_drones^2 + i), where i is the total number of intersections.
+        """
+        ori, i1_lo, i1_hi, i2_lo, i2_hi, idx_i, idx_j = [], [], [], [], [], [], []
+        for i in range(self.__n_drones):
+            for j in range(i + 1, self.__n_drones):
+                for intersection in self.__delta[self.__i_to_drone_id[i], self.__i_to_drone_id[j]]:
+                    ori.append(intersection.orientation)
+                    i1_lo.append(intersection.interval_1[0])
+                    i1_hi.append(intersection.interval_1[1])
+                    i2_lo.append(intersection.interval_2[0])
+                    i2_hi.append(intersection.interval_2[1])
+                    idx_i.append(i)
+                    idx_j.append(j)
+
+        self.__ori = np.array(ori, dtype=int)
+        self.__i1_lo = np.array(i1_lo, dtype=float)
+        self.__i1_hi = np.array(i1_hi, dtype=float)
+        self.__i2_lo = np.array(i2_lo, dtype=float)
+        self.__i2_hi = np.array(i2_hi, dtype=float)
+        self.__idx_i = np.array(idx_i, dtype=int)
+        self.__idx_j = np.array(idx_j, dtype=int)
+
+        # The blocking edges only depend on the intersections, so they are computed here once
+        cw = self.__ori == 1
+        self.__wall = np.where(cw, self.__i1_lo, self.__i2_lo)
+        self.__span = np.where(cw, self.__i2_hi, self.__i1_hi)
+        self.__idx_p = np.where(cw, self.__idx_i, self.__idx_j)
+        self.__idx_q = np.where(cw, self.__idx_j, self.__idx_i)
+
+    def __clear_intersections(self):
+        """
+        Releases the flattened intersections, which are only valid during a call to coordinate.
+        """
+        self.__ori = None
+        self.__i1_lo = None
+        self.__i1_hi = None
+        self.__i2_lo = None
+        self.__i2_hi = None
+        self.__idx_i = None
+        self.__idx_j = None
+        self.__wall = None
+        self.__span = None
+        self.__idx_p = None
+        self.__idx_q = None
+
+    def __maximal_velocity(self, x_last, x_goal):
         """
         Calculates the velocities for every drone, to be followed until the next event.
-        O(n_drones + i), where i is the total number of intersections.
-        :param x: List of np.array of size n_drones and dtype float. Contains, for each step,
-        the position for each drone in the coordination space.
+        O(n_drones + i), where i is the total number of intersections. Vectorized over the
+        flattened intersections.
+        :param x_last: np.array of size n_drones and dtype float. Contains the current position
+        for each drone in the coordination space.
         :param x_goal: np.array of size n_drones and dtype float. Contains, for each drone, the
         final position in the coordination space.
         :return: np.array of size n_drones and dtype float. Represents a velocity for every
         drone in the coordination space.
         """
-        v = np.ones(self.__n_drones, dtype=float) * MAX_VEL
+        xi = x_last[self.__idx_i]
+        xj = x_last[self.__idx_j]
+        cw = self.__ori == 1
 
         # Drones that are finished
-        for i in range(self.__n_drones):
-            if abs(x[-1][i] - x_goal[i]) < EPS:
-                v[i] = 0.0
+        stop = np.abs(x_last - x_goal) < EPS
 
-        # Going through each intersection
-        for i in range(self.__n_drones):
-            for j in range(self.__n_drones):
-                if j <= i:
-                    continue
+        # Clockwise: at the left edge of the interval, except the top-left corner
+        stop_i = np.logical_and(cw, np.logical_and(xi > self.__i1_lo - EPS,
+                                                   xj < self.__i2_hi - EPS))
+        # Counterclockwise: at the bottom edge of the interval, except the bottom-right corner
+        stop_j = np.logical_and(~cw, np.logical_and(xi < self.__i1_hi - EPS,
+                                                    xj > self.__i2_lo - EPS))
+        stop[self.__idx_i[stop_i]] = True
+        stop[self.__idx_j[stop_j]] = True
 
-                for intersection in self.__delta[self.__i_to_drone_id[i], self.__i_to_drone_id[j]]:
-                    if intersection.orientation == 1:
-                        # At the left edge of the interval, except the top-left corner
-                        if x[-1][i] > intersection.interval_1[0] - EPS and \
-                                x[-1][j] < intersection.interval_2[1] - EPS:
-                            v[i] = 0
-                    else:
-                        # At the bottom edge of the interval, except the bottom-right corner
-                        if x[-1][i] < intersection.interval_1[1] - EPS and \
-                                x[-1][j] > intersection.interval_2[0] - EPS:
-                            v[j] = 0
+        v = np.where(stop, 0.0, MAX_VEL)
 
         # If all drones will be stopped, something is wrong
         if np.all(v < EPS):
@@ -184,56 +263,54 @@ class Coordinator:
 
         return v
 
-    def __event_dt(self, x, x_goal, v):
+    def __event_dt(self, x_last, x_goal, v):
         """
         Computes the time until the next event.
-        O(n_drones + i), where i is the total number of intersections.
-        :param x: List of np.array of size n_drones and dtype float. Contains, for each step,
-        the position for each drone in the coordination space.
+        O(n_drones + i), where i is the total number of intersections. Vectorized over the
+        flattened intersections.
+        :param x_last: np.array of size n_drones and dtype float. Contains the current position
+        for each drone in the coordination space.
         :param x_goal: np.array of size n_drones and dtype float. Contains, for each drone, the
         final position in the coordination space.
         :param v: np.array of size n_drones and dtype float. Contains a maximal velocity for
         each drone in the coordination space.
         :return: float, Time until the next event.
         """
-        dt = float("inf")
+        moving = v > EPS
+        v_safe = np.where(moving, v, 1.0)
 
         # Time to reach the goals
-        for i in range(self.__n_drones):
-            if v[i] > EPS:
-                dt = min(dt, (x_goal[i] - x[-1][i]) / v[i])
-
-        # For each intersection
-        for i in range(self.__n_drones):
-            for j in range(self.__n_drones):
-                if j <= i:
-                    continue
-
-                for intersection in self.__delta[self.__i_to_drone_id[i], self.__i_to_drone_id[j]]:
-                    # Tracing ray in direction (v[i], v[j])
-                    pt = Point(x[-1][i], x[-1][j])
-                    vec = Point(v[i], v[j])
-                    if intersection.orientation == 1:
-                        seg = Segment(Point(intersection.interval_1[0], 0),
-                                      Point(intersection.interval_1[0], intersection.interval_2[1]))
-                    else:
-                        seg = Segment(Point(0, intersection.interval_2[0]),
-                                      Point(intersection.interval_1[1], intersection.interval_2[0]))
-
-                    # One drone is stopped, the event is at the end of the segment
-                    if seg.contains(pt):
-                        # If it is at the end of the segment, ignore
-                        if not (seg.a == pt or seg.b == pt):
-                            if intersection.orientation == 1:
-                                dt = min(dt, (intersection.interval_2[1] - pt.y) / v[j])
-                            else:
-                                dt = min(dt, (intersection.interval_1[1] - pt.x) / v[i])
-                    # If it reached the segment
-                    elif seg.intersection_with_line_2d(pt, vec):
-                        if intersection.orientation == 1:
-                            dt = min(dt, (intersection.interval_1[0] - pt.x) / v[i])
-                        else:
-                            dt = min(dt, (intersection.interval_2[0] - pt.y) / v[j])
+        dt_goal = np.where(moving, (x_goal - x_last) / v_safe, np.inf)
+
+        # For each intersection, the edge which blocks one of the drones is an axis-aligned segment
+        # in the delta space. Clockwise: vertical segment at x = interval_1[0], from y = 0 to
+        # y = interval_2[1]. Counterclockwise: horizontal segment at y = interval_2[0], from x = 0
+        # to x = interval_1[1]. p is the coordinate perpendicular to the segment and q the one
+        # along it.
+        wall = self.__wall
+        span = self.__span
+        p = x_last[self.__idx_p]
+        q = x_last[self.__idx_q]
+        vp = v_safe[self.__idx_p]
+        vq = v_safe[self.__idx_q]
+        p_moving = moving[self.__idx_p]
+        q_moving = moving[self.__idx_q]
+
+        # One drone is stopped on the segment, the event is at the end of the segment. If it is
+        # at one of the ends of the segment, ignore
+        dp2 = (p - wall) ** 2
+        on_seg = dp2 + (np.clip(q, 0.0, span) - q) ** 2 < EPS_SQUARED
+        at_end = dp2 + np.minimum(q ** 2, (q - span) ** 2) < EPS_SQUARED
+        dt_on_seg = np.where(q_moving, (span - q) / vq, np.inf)
+
+        # Tracing ray in direction (v[i], v[j]), checking if it reaches the segment
+        dt_hit = (wall - p) / vp
+        q_hit = q + vq * np.where(q_moving, dt_hit, 0.0)
+        hit = p_moving & (dt_hit > -EPS) & (q_hit > -EPS) & (q_hit < span + EPS)
+
+        dt_intersections = np.where(on_seg, np.where(at_end, np.inf, dt_on_seg),
+                                    np.where(hit, dt_hit, np.inf))
+        dt = float(np.min(np.concatenate((dt_goal, dt_intersections))))
 
         if dt < EPS:
             raise ValueError("Something went wrong. Next event is current event")
@@ -244,9 +321,9 @@ class Coordinator:
         """
         Converts x, which is a list of positions for every drone in the coordination space, into
         paths, which is a dict mapping drone_id to the Path object to follow.
-        :param x: List of np.array of size n_drones and dtype float. Contains, for each step,
+        :param x: np.array of size n_events x n_drones and dtype float. Contains, for each step,
         the position for each drone in the coordination space.
-        :param t: List of times for every step in x, in respect to the start time.
+        :param t: np.array of times for every step in x, in respect to the start time.
         :param old_paths: Dict mapping drone_id to Path objects representing a path to follow.
         :return: Dict of Path objects, a coordinated roadmap for the drones.
         """
@@ -254,29 +331,25 @@ class Coordinator:
         def merge_events(x, t):
             """
             Merges events if the drone keeps the same velocity between them.
-            :param x: List of floats, positions of a drone in the coordination space.
-            :param t: List of floats, time the drone should be at that position.
-            :return: Tuple with merged_x, merged_t.
+            :param x: np.array of floats, positions of a drone in the coordination space.
+            :param t: np.array of floats, time the drone should be at that position.
+            :return: Tuple with merged_x, merged_t, lists of floats.
             """
-            merged_x = [x[0]]
-            merged_t = [t[0]]
-            for i in range(1, len(x) - 1):
-                vl = (x[i] - x[i - 1]) / (t[i] - t[i - 1])
-                vr = (x[i + 1] - x[i]) / (t[i + 1] - t[i])
-                if abs(vl - vr) > EPS:
-                    merged_x.append(x[i])
-                    merged_t.append(t[i])
-            merged_x.append(x[-1])
-            merged_t.append(t[-1])
-
-            return merged_x, merged_t
+            # Velocity between each pair of consecutive events, keeping the inner events in which
+            # it changes
+            v = np.diff(x) / np.diff(t)
+            keep = np.abs(np.diff(v)) > EPS
+            merged_x = np.concatenate(([x[0]], x[1:-1][keep], [x[-1]]))
+            merged_t = np.concatenate(([t[0]], t[1:-1][keep], [t[-1]]))
+
+            return merged_x.tolist(), merged_t.tolist()
 
         paths = {}
         for k in range(self.__n_drones):
             drone_id = self.__i_to_drone_id[k]
             lengths = old_paths[drone_id].get_lengths()
             poses = old_paths[drone_id].poses
-            merged_x, merged_t = merge_events([v[k] for v in x], t)
+            merged_x, merged_t = merge_events(x[:, k], t)
             n_events = len(merged_x)
 
             paths[drone_id] = Path()
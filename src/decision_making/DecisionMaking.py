@@ -88,3 +88,11 @@ class DecisionMaking:
         """
         if self.__is_paused and drone_id in self.__drones:
             self.__drones[drone_id].stop()
+
+    def stop_all(self):
+        """
+        Completely stops all the drones, killing their motors.
+        """
+        if self.__is_paused:
+            for drone in self.__drones.values():
+                drone.stop()
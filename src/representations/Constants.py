@@ -1,3 +1,4 @@
+from collections import namedtuple
 from std_msgs.msg import ColorRGBA
 
 # Rate to update the drones in rviz
@@ -9,6 +10,7 @@ N_DRONES = 12
 # Double precision
 GROUND_EPS = 0.05  # m
 EPS = 1e-6  # m
+EPS_SQUARED = EPS * EPS  # m^2
 
 # Room limits for the drones to be in.
 # TODO: put good values
@@ -36,25 +38,47 @@ MESH_EDGE_DIST = 0.5  # m
 # Height of the drone when it is on the floor
 DRONE_HEIGHT = 0.035
 
+# Colors are immutable, so they can be shared safely. Use color_to_ros to get a ROS message.
+RGBA = namedtuple('RGBA', 'r g b a')
+_ROS_COLORS = {}  # ColorRGBA for each RGBA, built on first use
+
+
+def color_to_ros(color):
+    """
+    Converts a color to the ROS ColorRGBA message. The message is shared by every caller, so it
+    must not be modified.
+    :param color: RGBA color.
+    :return: rosmsg ColorRGBA type.
+    """
+    ros_color = _ROS_COLORS.get(color)
+    if ros_color is None:
+        ros_color = ColorRGBA(color.r, color.g, color.b, color.a)
+        _ROS_COLORS[color] = ros_color
+    return ros_color
+
+
 # Colors for drones
-BLUE = ColorRGBA(0.0, 0.0, 1.0, 1.0)
-RED = ColorRGBA(1.0, 0.0, 0.0, 1.0)
-YELLOW = ColorRGBA(1.0, 1.0, 0.0, 1.0)
-GREEN = ColorRGBA(0.0, 1.0, 0.0, 1.0)
-PINK = ColorRGBA(1.0, 0.0781, 0.5742, 1.0)
-WHITE = ColorRGBA(1.0, 1.0, 1.0, 1.0)
-ORANGE = ColorRGBA(0.9726, 0.5820, 0.0273, 1.0)
-COLORS = [BLUE, YELLOW, PINK, GREEN, WHITE, ORANGE]
+BLUE = RGBA(0.0, 0.0, 1.0, 1.0)
+RED = RGBA(1.0, 0.0, 0.0, 1.0)
+YELLOW = RGBA(1.0, 1.0, 0.0, 1.0)
+GREEN = RGBA(0.0, 1.0, 0.0, 1.0)
+PINK = RGBA(1.0, 0.0781, 0.5742, 1.0)
+WHITE = RGBA(1.0, 1.0, 1.0, 1.0)
+ORANGE = RGBA(0.9726, 0.5820, 0.0273, 1.0)
+COLORS = (BLUE, YELLOW, PINK, GREEN, WHITE, ORANGE)
 
 # Colors for trajectory
-BLUE_T = ColorRGBA(0.0, 0.0, 1.0, 0.2)
-RED_T = ColorRGBA(1.0, 0.0, 0.0, 0.2)
-YELLOW_T = ColorRGBA(1.0, 1.0, 0.0, 0.2)
-GREEN_T = ColorRGBA(0.0, 1.0, 0.0, 0.2)
-PINK_T = ColorRGBA(1.0, 0.0781, 0.5742, 0.2)
-WHITE_T = ColorRGBA(1.0, 1.0, 1.0, 0.2)
-ORANGE_T = ColorRGBA(0.9726, 0.5820, 0.0273, 0.2)
-COLORS_T = [BLUE_T, YELLOW_T, PINK_T, GREEN_T, WHITE_T, ORANGE_T]
+BLUE_T = RGBA(0.0, 0.0, 1.0, 0.2)
+RED_T = RGBA(1.0, 0.0, 0.0, 0.2)
+YELLOW_T = RGBA(1.0, 1.0, 0.0, 0.2)
+GREEN_T = RGBA(0.0, 1.0, 0.0, 0.2)
+PINK_T = RGBA(1.0, 0.0781, 0.5742, 0.2)
+WHITE_T = RGBA(1.0, 1.0, 1.0, 0.2)
+ORANGE_T = RGBA(0.9726, 0.5820, 0.0273, 0.2)
+COLORS_T = (BLUE_T, YELLOW_T, PINK_T, GREEN_T, WHITE_T, ORANGE_T)
+
+# Frame in which markers are drawn
+MARKER_FRAME_ID = '1'
 
 # Marker size
 MARKER_SIZE_X = 0.2
@@ -1,10 +1,12 @@
 import math
 from geometry_msgs import msg
 
-from representations.Constants import EPS
+from representations.Constants import EPS_SQUARED
 
 
-class Point:
+class Point(object):
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, *args):
         """
         Default constructor. Receives geometry_msgs.Point or (x, y, z).
@@ -75,11 +77,17 @@ class Point:
 
     def __eq__(self, p):
         """
-        Equal operator.
+        Equal operator. Compares the squared distance, avoiding the square roots.
         :param p:
         :return: Boolean
         """
-        return self.dist(p) < EPS
+        dx = self.x - p.x
+        dy = self.y - p.y
+        dz = self.z - p.z
+        return dx * dx + dy * dy + dz * dz < EPS_SQUARED
+
+    # Equality has a tolerance, so no hash can be consistent with it
+    __hash__ = None
 
     def __neg__(self):
         """
@@ -102,7 +110,7 @@ class Point:
         :param p: Point to be subtracted.
         :return: Subtraction of points.
         """
-        return self + p.__neg__()
+        return Point(self.x - p.x, self.y - p.y, self.z - p.z)
 
     def __mul__(self, k):
         """
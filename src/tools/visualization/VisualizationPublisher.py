@@ -1,7 +1,7 @@
 import math
-import rospy
-import time
 import threading
+import numpy as np
+import rospy
 from visualization_msgs.msg import Marker
 from visualization_msgs.msg import MarkerArray
 from geometry_msgs.msg import Point
@@ -10,31 +10,65 @@ from tf.transformations import quaternion_from_euler
 from representations.Constants import COLORS
 from representations.Constants import COLORS_T
 from representations.Constants import MARKER_ARROW_SIZES
+from representations.Constants import MARKER_FRAME_ID
 from representations.Constants import MARKER_LINE_SIZE_X
 from representations.Constants import WHITE, RED
+from representations.Constants import color_to_ros
 from representations.Constants import MIN_X, MAX_X, MIN_Y, MAX_Y, MIN_Z, MAX_Z
 from representations.Constants import VISUALIZATION_RATE
-from representations.Constants import EPS
+from representations.Constants import EPS, EPS_SQUARED
 from representations.obstacles.Cylinder import Cylinder
-import representations.Point
 
 
 class VisualizationPublisher:
+    """
+    Publishes drones, paths, goals, obstacles and the mesh as rviz markers. Drone markers are
+    refreshed by a timer at VISUALIZATION_RATE. The process using this class must call
+    rospy.init_node once, before creating it.
+    """
+
     def __init__(self, drones):
         """
         Basic constructor
         """
         self.__drones = drones
         self.__drone_color_map = {}
-        for drone_id in drones:
-            self.add_drone(drones[drone_id])
 
-        # Markers
-        self.__past_path_markers = {}
+        # Markers. The marker arrays are reused for every frame, and only rebuilt when drones are
+        # added or removed. Markers keep the action they are built with, since ADD and MODIFY are
+        # the same action in rviz
         self.__drone_markers = {}
+        self.__drone_marker_array = MarkerArray()
+        self.__drone_poses = None  # Tuple of the published poses, to skip unchanged frames
+
+        # The timer thread iterates this snapshot of (drone, past path color) instead of the drones
+        # dict. The lock guards it and the per-frame state, and is held for the whole timer tick
+        self.__lock = threading.Lock()
+        self.__frame = ()
+
+        # Goal poses are published by the timer, so several updates within a tick are sent once
+        self.__goal_poses = None
+        self.__goals_dirty = False
+
+        # Past paths of all drones are drawn by a single LINE_LIST marker, with a segment from the
+        # last position to the current one for each drone. A new marker id is used every frame, so
+        # rviz keeps the previous segments
+        self.__last_positions = {}
+        self.__past_path_colors = {}
+        self.__past_path_marker = Marker()
+        self.__past_path_marker.header.frame_id = MARKER_FRAME_ID
+        self.__past_path_marker.type = Marker.LINE_LIST
+        self.__past_path_marker.action = Marker.ADD
+        self.__past_path_marker.id = 1000
+        self.__past_path_marker.scale.x = MARKER_LINE_SIZE_X
+        self.__past_path_marker_array = MarkerArray(markers=[self.__past_path_marker])
 
         # Publishers
-        self.__drone_publisher = rospy.Publisher('visualization_drones', MarkerArray, queue_size=10)
+        # Each drone frame supersedes the previous one, so only the latest needs to be queued, and
+        # it is sent right away instead of being held back by Nagle's algorithm. Unchanged frames
+        # aren't published, so it is latched for new subscribers
+        self.__drone_publisher = rospy.Publisher('visualization_drones', MarkerArray, queue_size=1,
+                                                 latch=True, tcp_nodelay=True)
         self.__past_path_publisher = rospy.Publisher('visualization_ppath', MarkerArray,
                                                      queue_size=10)
         self.__future_path_publisher = rospy.Publisher('visualization_fpath', Marker, queue_size=10)
@@ -45,56 +79,86 @@ class VisualizationPublisher:
                                                     queue_size=10)
         self.__mesh_publisher = rospy.Publisher('visualization_mesh', Marker, queue_size=10)
 
-        self.__terminated = False
-        self.__run_thread()
+        for drone_id in drones:
+            self.add_drone(drones[drone_id])
+
+        # Drone markers are refreshed by a timer, which runs on its own thread
+        self.__timer = rospy.Timer(rospy.Duration(1.0 / VISUALIZATION_RATE),
+                                   self.__timer_callback)
 
     def update_drones(self):
         """
         Updates drone markers and past path on rviz.
         """
-        # Updating drone poses
-        for drone in self.__drones.values():
-            marker = self.__drone_markers[drone.id]
-            marker.action = Marker.MODIFY
-            marker.pose = drone.pose
-        m = MarkerArray()
-        m.markers = list(self.__drone_markers.values())
-        self.__drone_publisher.publish(m)
-
-        # Updating past path
-        for drone in self.__drones.values():
-            marker = self.__past_path_markers[drone.id]
-            marker.action = Marker.MODIFY
-            marker.id += 1
-            if len(marker.points) == 2:
-                marker.points[0] = marker.points[1]
-                marker.points[1] = Point(drone.pose.position.x, drone.pose.position.y,
-                                         drone.pose.position.z)
-            else:
-                marker.points.append(Point(drone.pose.position.x, drone.pose.position.y,
-                                           drone.pose.position.z))
-        m.markers = list(self.__past_path_markers.values())
-        self.__past_path_publisher.publish(m)
+        # The whole tick holds the lock, so a tick can't write back the state of a drone that was
+        # removed meanwhile, nor publish its markers again after they were deleted
+        with self.__lock:
+            # Updating drone poses and past paths in a single pass, reading each pose once. Drone
+            # markers hold a reference to the pose of their drone, which is updated in place. Only
+            # what changed since the last frame is published
+            poses = []
+            points = []
+            colors = []
+            for drone, color in self.__frame:
+                pose = drone.pose
+                p = pose.position
+                o = pose.orientation
+                poses.append((p.x, p.y, p.z, o.x, o.y, o.z, o.w))
+
+                position = (p.x, p.y, p.z)
+                last_position = self.__last_positions.get(drone.id)
+                if last_position is not None and last_position != position:
+                    points.append(Point(*last_position))
+                    points.append(Point(*position))
+                    colors.append(color)
+                    colors.append(color)
+                self.__last_positions[drone.id] = position
+
+            poses = tuple(poses)
+            if poses != self.__drone_poses:
+                self.__drone_poses = poses
+                self.__drone_publisher.publish(self.__drone_marker_array)
+
+            if len(points) > 0:
+                marker = self.__past_path_marker
+                marker.id += 1
+                marker.points = points
+                marker.colors = colors
+                self.__past_path_publisher.publish(self.__past_path_marker_array)
 
     def update_goal_poses(self, goal_poses):
         """
-        Refreshes goal poses in rviz.
+        Refreshes goal poses in rviz. They are published on the next tick of the timer.
         :param goal_poses: Dict of StablePoses for each drone.
         """
         if goal_poses is None:
             return
 
-        markers = MarkerArray()
-        if 0 in goal_poses and len(self.__drones) % 2 == 0:
-            markers.markers.append(self.__get_pose_marker(
-                goal_poses[0].to_ros(), WHITE, 0, 0.7))
-        for drone_id in self.__drones:
-            if drone_id in goal_poses:
-                markers.markers.append(self.__get_pose_marker(
-                    goal_poses[drone_id].to_ros(),
-                    COLORS[self.__drone_color_map[drone_id]], drone_id, 0.5))
+        with self.__lock:
+            self.__goal_poses = goal_poses
+            self.__goals_dirty = True
 
-        self.__goal_publisher.publish(markers)
+    def __publish_goal_poses(self):
+        """
+        Publishes the goal poses, if they changed since the last tick.
+        """
+        # Published under the lock, so goals cleared by remove_drone can't be published again
+        with self.__lock:
+            if not self.__goals_dirty:
+                return
+            self.__goals_dirty = False
+            goal_poses = self.__goal_poses
+            frame = self.__frame
+
+            markers = []
+            if 0 in goal_poses and len(frame) % 2 == 0:
+                markers.append(self.__get_pose_marker(goal_poses[0].to_ros(), WHITE, 0, 0.7))
+            markers += [self.__get_pose_marker(goal_poses[drone.id].to_ros(),
+                                               COLORS[self.__drone_color_map[drone.id]],
+                                               drone.id, 0.5)
+                        for drone, _ in frame if drone.id in goal_poses]
+
+            self.__goal_publisher.publish(MarkerArray(markers=markers))
 
     def update_world(self, mesh=None, obstacle_collection=None):
         """
@@ -119,29 +183,22 @@ class VisualizationPublisher:
                 self.__update_future_path(drone_id, self.__drones[drone_id].path)
 
     def add_drone(self, drone):
-        # Updating color map
-        cnt = len(self.__drone_color_map)
-        self.__drone_color_map[drone.id] = cnt
-
-        # Creating its marker
-        self.__drone_markers[drone.id] = self.__get_pose_marker(
-            drone.pose, COLORS[self.__drone_color_map[drone.id]], drone.id, 1)
-        m = MarkerArray()
-        m.markers = list(self.__drone_markers.values())
-        self.__drone_publisher.publish(m)
-
-        # Creating past trajectory marker
-        marker = Marker()
-        marker.header.frame_id = str(1)
-        marker.type = Marker.LINE_STRIP
-        marker.action = Marker.ADD
-        marker.id = 1000 + drone.id * 100000
-        marker.color = COLORS_T[self.__drone_color_map[drone.id]]
-
-        # Size of the line
-        marker.scale.x = MARKER_LINE_SIZE_X
-
-        self.__past_path_markers[drone.id] = marker
+        # Updating color map. Colors are reused once all of them are taken
+        self.__drone_color_map[drone.id] = len(self.__drone_color_map) % len(COLORS)
+
+        with self.__lock:
+            # Creating its marker
+            self.__drone_markers[drone.id] = self.__get_pose_marker(
+                drone.pose, COLORS[self.__drone_color_map[drone.id]], drone.id, 1)
+            self.__drone_marker_array = MarkerArray(markers=list(self.__drone_markers.values()))
+            self.__drone_poses = None
+            self.__drone_publisher.publish(self.__drone_marker_array)
+
+            # Color of its past path
+            self.__past_path_colors[drone.id] = color_to_ros(
+                COLORS_T[self.__drone_color_map[drone.id]])
+            self.__last_positions.pop(drone.id, None)
+            self.__update_frame()
 
     def remove_drone(self, drone_id=0):
         if drone_id == 0:
@@ -153,12 +210,16 @@ class VisualizationPublisher:
             self.__future_path_publisher.publish(m)
             self.__future_path_collisions_publisher.publish(m)
 
-            # Clearing future path
-            self.__clear_past_paths()
-            self.__past_path_markers.clear()
-
-            # Clearing goal markers
-            self.__goal_publisher.publish(m)
+            # Clearing past path
+            with self.__lock:
+                self.__clear_past_paths()
+                self.__last_positions.clear()
+                self.__past_path_colors.clear()
+                self.__frame = ()
+
+                # Clearing goal markers
+                self.__goals_dirty = False
+                self.__goal_publisher.publish(m)
         else:
             # Clearing future path
             marker = Marker()
@@ -167,36 +228,47 @@ class VisualizationPublisher:
             self.__future_path_collisions_publisher.publish(marker)
 
             # Clearing past path
-            self.__clear_past_paths()
-            del self.__past_path_markers[drone_id]
-
-            # Clearing drone marker
-            self.__drone_markers[drone_id].action = Marker.DELETE
-            m = MarkerArray()
-            m.markers = list(self.__drone_markers.values())
-            self.__drone_publisher.publish(m)
-            del self.__drone_markers[drone_id]
-
-            # Clearing goal markers
-            m.markers = [marker]
-            self.__goal_publisher.publish(m)
+            with self.__lock:
+                self.__clear_past_paths()
+                self.__last_positions.pop(drone_id, None)
+                del self.__past_path_colors[drone_id]
+
+                # Clearing drone marker
+                self.__drone_markers[drone_id].action = Marker.DELETE
+                self.__drone_publisher.publish(self.__drone_marker_array)
+                del self.__drone_markers[drone_id]
+                self.__drone_marker_array = MarkerArray(
+                    markers=list(self.__drone_markers.values()))
+                self.__drone_poses = None
+                self.__update_frame()
+
+                # Clearing goal markers
+                self.__goals_dirty = False
+                m = MarkerArray()
+                m.markers = [marker]
+                self.__goal_publisher.publish(m)
 
     def terminate(self):
         """
-        Stops running the thread.
+        Stops updating the drones.
         """
-        self.__terminated = True
+        self.__timer.shutdown()
 
-    def __run_thread(self):
-        def pipeline():
-            while not rospy.is_shutdown() and not self.__terminated:
-                cur_t = time.time()
-                self.update_drones()
-                t_remaining = max(0, 1.0 / VISUALIZATION_RATE - (time.time() - cur_t))
-                time.sleep(t_remaining)
+    def __timer_callback(self, event):
+        """
+        Callback for the timer which updates the drones and the goal poses.
+        :param event: rospy.TimerEvent.
+        """
+        self.update_drones()
+        self.__publish_goal_poses()
 
-        t = threading.Thread(target=pipeline)
-        t.start()
+    def __update_frame(self):
+        """
+        Rebuilds the snapshot read by the timer thread. Must be called with the lock held.
+        """
+        self.__frame = tuple((drone, self.__past_path_colors[drone.id])
+                             for drone in self.__drones.values()
+                             if drone.id in self.__drone_markers)
 
     def __update_obstacles(self, obstacle_collection):
         """
@@ -207,11 +279,11 @@ class VisualizationPublisher:
         for obstacle in obstacle_collection.obstacles:
             if isinstance(obstacle, Cylinder):
                 m = Marker()
-                m.header.frame_id = str(1)
+                m.header.frame_id = MARKER_FRAME_ID
                 m.type = Marker.CYLINDER
                 m.action = Marker.ADD
                 m.id = obstacle_collection.obstacles.index(obstacle)
-                m.color = WHITE
+                m.color = color_to_ros(WHITE)
 
                 m.scale.x = 2 * obstacle.radius
                 m.scale.y = 2 * obstacle.radius
@@ -245,11 +317,11 @@ class VisualizationPublisher:
         :param mesh: Mesh object representing the space.
         """
         m = Marker()
-        m.header.frame_id = str(1)
+        m.header.frame_id = MARKER_FRAME_ID
         m.type = Marker.LINE_LIST
         m.action = Marker.ADD
         m.id = 1
-        m.color = RED
+        m.color = color_to_ros(RED)
 
         m.scale.x = 0.001
 
@@ -274,48 +346,58 @@ class VisualizationPublisher:
         :param path: Path object.
         """
         m = Marker()
-        m.header.frame_id = str(1)
+        m.header.frame_id = MARKER_FRAME_ID
         m.type = Marker.LINE_LIST
         m.action = Marker.ADD
         m.id = drone_id
-        m.color = COLORS[self.__drone_color_map[drone_id]]
+        m.color = color_to_ros(COLORS[self.__drone_color_map[drone_id]])
         m.scale.x = 0.02
 
         c = Marker()
-        c.header.frame_id = str(1)
+        c.header.frame_id = MARKER_FRAME_ID
         c.type = Marker.POINTS
         c.action = Marker.ADD
         c.id = drone_id
-        c.color = WHITE
+        c.color = color_to_ros(WHITE)
         c.scale.x = 0.05
         c.scale.y = 0.05
         c.scale.z = 0.05
 
-        for i in range(1, len(path.poses)):
-            m.points.append(path.poses[i-1].position())
-            m.points.append(path.poses[i].position())
-
-        for intersection in path.intersections:
-            dist_from_start = 0
-            for i in range(1, len(path.poses)):
-                p1 = representations.Point.Point(path.poses[i - 1].position())
-                p2 = representations.Point.Point(path.poses[i].position())
-                if p1 != p2:
-                    for j in range(2):
-                        if dist_from_start - EPS < intersection[j] < dist_from_start + p1.dist(p2):
-                            pt = p1 + (p2 - p1) * (intersection[j] - dist_from_start) / p1.dist(p2)
-                            c.points.append(Point(pt.x, pt.y, pt.z))
-
-                dist_from_start += p1.dist(p2)
+        # Consecutive segments share their common point
+        positions = [pose.position() for pose in path.poses]
+        m.points = [point for i in range(1, len(positions))
+                    for point in (positions[i - 1], positions[i])]
+
+        # Collision points of all intersections are found at once, with the path as arrays of
+        # segment starts and displacements
+        if len(path.intersections) > 0 and len(path.poses) > 1:
+            positions = np.array([(pose.x, pose.y, pose.z) for pose in path.poses], dtype=float)
+            starts = positions[:-1]
+            deltas = positions[1:] - starts
+            lengths = np.hypot(np.hypot(deltas[:, 0], deltas[:, 1]), deltas[:, 2])
+            dists_from_start = np.concatenate(([0.0], np.cumsum(lengths)[:-1]))
+            moving = deltas[:, 0] * deltas[:, 0] + deltas[:, 1] * deltas[:, 1] + \
+                deltas[:, 2] * deltas[:, 2] >= EPS_SQUARED
+
+            # hits[k, i, j] tells if the j-th distance of intersection k lies on segment i
+            dists = np.array(path.intersections, dtype=float)[:, np.newaxis, :]
+            hits = moving[:, np.newaxis] & \
+                (dists_from_start[:, np.newaxis] - EPS < dists) & \
+                (dists < (dists_from_start + lengths)[:, np.newaxis])
+            k, i, j = np.nonzero(hits)
+            dists = dists[k, 0, j]
+            points = starts[i] + deltas[i] * (dists - dists_from_start[i])[:, np.newaxis] / \
+                lengths[i][:, np.newaxis]
+            c.points = [Point(x, y, z) for x, y, z in points.tolist()]
 
         self.__future_path_publisher.publish(m)
         self.__future_path_collisions_publisher.publish(c)
 
     def __clear_past_paths(self):
-        for drone_id in self.__past_path_markers:
-            self.__past_path_markers[drone_id].action = Marker.DELETEALL
+        marker = Marker()
+        marker.action = Marker.DELETEALL
         m = MarkerArray()
-        m.markers = list(self.__past_path_markers.values())
+        m.markers = [marker]
         self.__past_path_publisher.publish(m)
 
     @staticmethod
@@ -323,17 +405,17 @@ class VisualizationPublisher:
         """
         Creates an arrow marker with information from a pose.
         :param pose: Pose object to be created.
-        :param color: Color of the marker.
+        :param color: RGBA color of the marker.
         :param id: Id of the marker.
         :param scale: float to adjust marker size.
         :return: Arrow Marker representing the pose.
         """
         marker = Marker()
-        marker.header.frame_id = str(1)
+        marker.header.frame_id = MARKER_FRAME_ID
         marker.type = Marker.ARROW
         marker.action = Marker.ADD
         marker.id = id
-        marker.color = color
+        marker.color = color_to_ros(color)
 
         marker.scale.x = scale * MARKER_ARROW_SIZES[0]
         marker.scale.y = scale * MARKER_ARROW_SIZES[1]